@@ -5,14 +5,103 @@ import numpy as np
 import os
 import sqlite3
 import face_recognition
+import dlib
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime, timedelta
 import pickle
+import json
+import hashlib
+import hmac
+import multiprocessing
+import secrets
 import shutil
 import random
 import re
+import sys
 import threading
+import time
+import queue
+from PIL import Image, ImageTk
+
+try:
+    import faiss  # Optional: faster nearest-neighbour search for large classes
+except ImportError:
+    faiss = None
+
+try:
+    from numba import njit  # Optional: compiled nearest-encoding scan
+except ImportError:
+    njit = None
+
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def nearest_encoding(matrix, probe):
+        """Return (index, squared distance) of the row of matrix closest to probe"""
+        best_index = 0
+        best_distance = np.inf
+        for i in range(matrix.shape[0]):
+            distance = 0.0
+            for j in range(matrix.shape[1]):
+                diff = matrix[i, j] - probe[j]
+                distance += diff * diff
+            if distance < best_distance:
+                best_index = i
+                best_distance = distance
+        return best_index, best_distance
+else:
+    nearest_encoding = None
 
 class AttendanceSystem:
+    # scrypt cost (16 MB, a few tens of ms per hash); PBKDF2 is the fallback
+    # for Python builds whose OpenSSL lacks scrypt
+    SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 14, 8, 1
+    PASSWORD_HASH_ITERATIONS = 200000
+
+    # Attendance SQL kept as fixed strings so sqlite3's statement cache always hits
+    ATTENDANCE_STATEMENTS = {
+        'insert_time_in': '''
+            INSERT INTO attendance (student_username, date, time_in, status)
+            SELECT ?, ?, ?, 'Present'
+            WHERE NOT EXISTS (
+                SELECT 1 FROM attendance
+                WHERE student_username = ? AND date = ? AND time_in IS NOT NULL
+            )
+        ''',
+        'update_time_out': '''
+            UPDATE attendance
+            SET time_out = ?, status = 'Completed'
+            WHERE student_username = ? AND date = ? AND time_in IS NOT NULL AND time_out IS NULL
+        ''',
+        'find_time_in': '''
+            SELECT 1 FROM attendance
+            WHERE student_username = ? AND date = ? AND time_in IS NOT NULL
+        ''',
+    }
+
+    # Bump when create_schema changes so existing databases get migrated
+    SCHEMA_VERSION = 1
+
+    # With faiss installed, models with this many students switch from an exact
+    # flat index to IVF, probing FAISS_IVF_NPROBE clusters per face
+    FAISS_IVF_MIN_ROWS = 10000
+    FAISS_IVF_NPROBE = 8
+
+    # Attempts for a write batch that keeps hitting "database is locked"
+    DB_RETRIES = 3
+
+    # Training photos: quality 85 is plenty for face encodings and encodes faster
+    # than OpenCV's default of 95; no optimize/progressive passes
+    PHOTO_JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 85,
+                         cv2.IMWRITE_JPEG_OPTIMIZE, 0,
+                         cv2.IMWRITE_JPEG_PROGRESSIVE, 0]
+
+    EMAIL_PATTERN = re.compile(r'^[^@]+@[^@]+\.[^@]+$')
+
+    # Report rows are inserted into the Treeview this many at a time
+    REPORT_BATCH_SIZE = 500
+
     def __init__(self, root):
         self.root = root
         self.root.title("Facial Recognition Attendance System")
@@ -25,10 +114,37 @@ class AttendanceSystem:
         self.camera_lock = threading.Lock()
         self.camera_thread = None
         self.camera_ready = threading.Event()
+        self.camera_waiting = False  # open_camera is polling a preload for a caller
+        # While a preview runs, a grabber thread keeps the newest frame here
+        self.grabbed_frame = (True, None)
+        self.grabber_thread = None
+        self.grabber_stop = threading.Event()
+        self.preview_window = None
+        # Login and main screen widgets live in this frame, replaced by clear_window
+        self.screen = None
+        # The admin profile window is built once per admin session, then hidden and reshown
+        self.admin_profile = None
+        self.attendance_marks = None
         self.encoding_cache = None
+        # Every write is batched through a single background writer thread
+        self.write_queue = queue.Queue()
+        self.writer_thread = None
+        # Blocking work kept off the Tk thread: captured photo writes, password changes
+        self.io_pool = ThreadPoolExecutor(max_workers=2)
+        # dlib's CNN detector is much faster than HOG on a CUDA build, much slower without
+        self.face_detection_model = 'cnn' if dlib.DLIB_USE_CUDA else 'hog'
         
         # Initialize database
         self.init_database()
+        self.writer_thread = threading.Thread(target=self.db_writer_loop, daemon=True)
+        self.writer_thread.start()
+        
+        # numba compiles nearest_encoding on its first call (or loads it from the on-disk
+        # cache); trigger that now, in the background, so recognition doesn't stall on it
+        if nearest_encoding is not None:
+            threading.Thread(target=nearest_encoding,
+                             args=(np.zeros((1, 128), dtype=np.float32), np.zeros(128, dtype=np.float32)),
+                             daemon=True).start()
         
         # Create directories
         self.create_directories()
@@ -42,20 +158,127 @@ class AttendanceSystem:
     def on_closing(self):
         """Handle application closing"""
         self.release_camera()
+        # Finish writing any captured photos and pending password changes first;
+        # the password changes still need the writer thread to commit them
+        self.io_pool.shutdown(wait=True)
+        if self.writer_thread is not None:
+            # Let queued attendance writes commit before the connection closes
+            self.write_queue.put(None)
+            self.writer_thread.join(timeout=5)
         if hasattr(self, 'conn'):
+            try:
+                # Let SQLite refresh query planner statistics before exit
+                self.conn.execute('PRAGMA optimize')
+                # Fold the WAL back into the database file so it stays small between runs
+                self.conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+            except sqlite3.Error:
+                pass
             self.conn.close()
+        for read_conn in getattr(self, 'read_connections', []):
+            read_conn.close()
         self.root.destroy()
     
     def init_database(self):
         """Initialize SQLite database for users, students, and attendance"""
         # Connect with timeout to handle locks
-        self.conn = sqlite3.connect('attendance.db', timeout=10.0)
-        # Enable WAL mode for better concurrency
+        # The writer connection is shared with the writer thread;
+        # db_lock serializes every use of it. It runs in autocommit mode
+        # (isolation_level=None): sqlite3 issues no hidden BEGIN/COMMIT, a lone
+        # statement commits by itself, and anything that must be atomic (the
+        # writer's batches, the schema upgrade, the legacy cleanup) goes through
+        # transaction()'s explicit BEGIN IMMEDIATE/COMMIT
+        self.conn = sqlite3.connect('attendance.db', timeout=10.0, check_same_thread=False,
+                                    isolation_level=None)
+        self.db_lock = threading.RLock()
+        # Enable WAL mode for better concurrency (persistent, stored in the file)
         self.conn.execute('PRAGMA journal_mode=WAL')
-        # Set busy timeout
-        self.conn.execute('PRAGMA busy_timeout=10000')
+        # WAL makes NORMAL sync safe
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.configure_connection(self.conn)
         self.cursor = self.conn.cursor()
         
+        # SELECTs use read-only connections, one per thread (see reader()); under
+        # WAL readers never block on the writer or on each other
+        self.reader_local = threading.local()
+        self.read_connections = []
+        self.read_connections_lock = threading.Lock()
+        
+        # Tables, indexes and column migrations only run when the file predates
+        # SCHEMA_VERSION; an up-to-date database costs a single PRAGMA read
+        schema_version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if schema_version < self.SCHEMA_VERSION:
+            # All or nothing, so an interrupted upgrade is simply redone next start
+            with self.transaction():
+                self.create_schema()
+                self.conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+        
+        # Create default admin user if not exists
+        try:
+            # Seed only a missing admin, so a password the admin changed is never reset.
+            # The probe just spares normal startups the hash; the guarded INSERT is
+            # what decides, atomically, even if another process seeds in between
+            self.cursor.execute('SELECT 1 FROM users WHERE username = ?', ('admin',))
+            if self.cursor.fetchone() is None:
+                self.cursor.execute('''
+                    INSERT INTO users (username, password, is_admin)
+                    SELECT ?, ?, 1
+                    WHERE NOT EXISTS (SELECT 1 FROM users WHERE username = ?)
+                ''', ('admin', self.hash_password('admin123'), 'admin'))
+
+            # Clean up any legacy records for specific users so they don't
+            # appear as students or cause tuple issues.
+            cleanup_users = ('admin2', 'suraj', 'nayak', 'prashant', 'demo', 'shashank', 'nikhil')
+            cleanup_rows = [(legacy_user,) for legacy_user in cleanup_users]
+            placeholders = ', '.join('?' * len(cleanup_users))
+            try:
+                # These rows are almost always gone already; one indexed probe
+                # saves opening a write transaction on every startup
+                leftover = self.conn.execute(f'''
+                    SELECT 1 FROM users WHERE username IN ({placeholders})
+                    UNION ALL SELECT 1 FROM students WHERE username IN ({placeholders})
+                    UNION ALL SELECT 1 FROM attendance WHERE student_username IN ({placeholders})
+                    LIMIT 1
+                ''', cleanup_users * 3).fetchone()
+                if leftover:
+                    # Remove from users, students, and attendance tables in one transaction
+                    with self.transaction():
+                        self.conn.executemany('DELETE FROM users WHERE username = ?', cleanup_rows)
+                        self.conn.executemany('DELETE FROM students WHERE username = ?', cleanup_rows)
+                        self.conn.executemany('DELETE FROM attendance WHERE student_username = ?', cleanup_rows)
+            except Exception:
+                # Non‑critical cleanup; ignore failures
+                pass
+
+            for legacy_user in cleanup_users:
+                # Remove any photo folders for these users
+                try:
+                    photo_dir = os.path.join('photos', legacy_user)
+                    if os.path.exists(photo_dir):
+                        shutil.rmtree(photo_dir, ignore_errors=True)
+                except Exception:
+                    # Ignore filesystem errors as well
+                    pass
+
+            # Ensure that an existing "anand" login (if any) is mirrored into the students table
+            try:
+                self.cursor.execute(
+                    'SELECT username, password, COALESCE(email, "") FROM users WHERE username = ?',
+                    ('anand',)
+                )
+                row = self.cursor.fetchone()
+                if row:
+                    username, password, email = row
+                    # Reuse helper to keep students table in sync
+                    self.upsert_student_record(username, password, email)
+            except Exception:
+                # If anything goes wrong here, don't block app startup
+                pass
+        except Exception as e:
+            print(f"Warning: Could not create/update admin user: {e}")
+            # Try to continue anyway
+    
+    def create_schema(self):
+        """Create tables and indexes and add columns missing from older databases"""
         # Create users table (for login/register)
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -92,146 +315,280 @@ class AttendanceSystem:
             )
         ''')
         
+        # Index the attendance lookups: the per-student daily check, and the report,
+        # whose ORDER BY date DESC, student_username is then read straight off the index
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_attendance_user_date
+            ON attendance (student_username, date)
+        ''')
+        self.cursor.execute('DROP INDEX IF EXISTS idx_attendance_date')
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_attendance_date_user
+            ON attendance (date DESC, student_username)
+        ''')
+
         # Ensure new columns exist for legacy databases
-        self.ensure_column('users', 'email', 'email TEXT')
-        self.ensure_column('users', 'otp_verified', 'otp_verified INTEGER DEFAULT 0')
-        self.ensure_column('students', 'email', 'email TEXT')
-        
-        # Create default admin user if not exists
-        try:
-            self.cursor.execute('SELECT COUNT(*) FROM users WHERE username = ?', ('admin',))
-            admin_exists = self.cursor.fetchone()[0] > 0
-            
-            if not admin_exists:
-                self.cursor.execute('''
-                    INSERT INTO users (username, password, is_admin)
-                    VALUES (?, ?, ?)
-                ''', ('admin', 'admin123', 1))
-                self.conn.commit()
-            else:
-                # Ensure admin password and status are correct
-                self.cursor.execute('UPDATE users SET password = ?, is_admin = 1 WHERE username = ?', 
-                                  ('admin123', 'admin'))
+        self.ensure_columns('users', {'email': 'email TEXT',
+                                      'otp_verified': 'otp_verified INTEGER DEFAULT 0'})
+        self.ensure_columns('students', {'email': 'email TEXT'})
+
+    @staticmethod
+    def configure_connection(conn):
+        """Apply the per-connection PRAGMAs shared by the reader and writer"""
+        # Wait for locks instead of failing with "database is locked" right away
+        conn.execute('PRAGMA busy_timeout=10000')
+        # Keep temp data and hot pages in memory
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-20000')
+        conn.execute('PRAGMA mmap_size=268435456')
+
+    @contextmanager
+    def transaction(self):
+        """Run a block of writes as one BEGIN IMMEDIATE transaction, rolled back on error"""
+        with self.db_lock:
+            # Take the write lock up front so a read can't fail to upgrade mid-block
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.conn
                 self.conn.commit()
+            except BaseException:
+                # Includes a failed COMMIT (busy, disk full), which would otherwise
+                # leave the transaction open and make every later BEGIN fail
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                raise
 
-            # Clean up any legacy records for specific users so they don't
-            # appear as students or cause tuple issues.
-            cleanup_users = ('admin2', 'suraj', 'nayak', 'prashant', 'demo', 'shashank', 'nikhil')
-            for legacy_user in cleanup_users:
-                try:
-                    # Remove from users, students, and attendance tables
-                    self.cursor.execute('DELETE FROM users WHERE username = ?', (legacy_user,))
-                    self.cursor.execute('DELETE FROM students WHERE username = ?', (legacy_user,))
-                    self.cursor.execute('DELETE FROM attendance WHERE student_username = ?', (legacy_user,))
-                    self.conn.commit()
-                except Exception:
-                    # Non‑critical cleanup; ignore failures for each user
-                    pass
+    @staticmethod
+    def is_busy_error(error):
+        """Return True for the transient "database is locked/busy" OperationalError"""
+        message = str(error).lower()
+        return 'locked' in message or 'busy' in message
 
-                # Remove any photo folders for these users
-                try:
-                    photo_dir = os.path.join('photos', legacy_user)
-                    if os.path.exists(photo_dir):
-                        shutil.rmtree(photo_dir, ignore_errors=True)
-                except Exception:
-                    # Ignore filesystem errors as well
-                    pass
+    @staticmethod
+    def busy_backoff(attempt):
+        """Sleep before retrying a busy database: 10ms, 40ms, 160ms... plus jitter"""
+        # Jitter keeps two processes that collided from retrying in lockstep
+        time.sleep(0.01 * 4 ** attempt + random.random() * 0.01)
 
-            # Ensure that an existing "anand" login (if any) is mirrored into the students table
-            try:
-                self.cursor.execute(
-                    'SELECT username, password, COALESCE(email, "") FROM users WHERE username = ?',
-                    ('anand',)
-                )
-                row = self.cursor.fetchone()
-                if row:
-                    username, password, email = row
-                    # Reuse helper to keep students table in sync
-                    self.upsert_student_record(username, password, email)
-            except Exception:
-                # If anything goes wrong here, don't block app startup
-                pass
-        except Exception as e:
-            print(f"Warning: Could not create/update admin user: {e}")
-            # Try to continue anyway
-    
     def execute_db(self, query, params=None, fetch=False):
         """Execute database query with proper error handling"""
-        max_retries = 3
         is_select = query.strip().upper().startswith('SELECT')
-        
-        for attempt in range(max_retries):
-            try:
-                if params:
-                    self.cursor.execute(query, params)
-                else:
-                    self.cursor.execute(query)
-                
-                # Only commit for non-SELECT queries
-                if not is_select:
-                    self.conn.commit()
-                
-                if fetch:
-                    return self.cursor.fetchall()
-                elif fetch == 'one':
-                    return self.cursor.fetchone()
-                return True
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e).lower() and attempt < max_retries - 1:
-                    import time
-                    time.sleep(0.1 * (attempt + 1))  # Exponential backoff
-                    continue
-                else:
-                    raise
-            except Exception as e:
-                raise
+        if not is_select:
+            # Writes are serialized through the writer thread once it's running, so
+            # this process never competes with itself for SQLite's write lock
+            writer = self.writer_thread
+            if writer is not None and writer.is_alive() and threading.current_thread() is not writer:
+                future = Future()
+                self.write_queue.put(('statement', (query, params, fetch), future))
+                return future.result()
+            # Before the writer thread starts (and on the writer itself) the statement
+            # runs directly; the connection is in autocommit mode, so it commits alone
+            with self.db_lock:
+                return self.write_statement(query, params, fetch)
+        
+        if fetch == 'cursor':
+            # An unfinished SELECT pins its connection's WAL snapshot, so a stream gets
+            # a connection of its own rather than freezing the thread's shared reader.
+            # The caller ends the stream with cursor.connection.close()
+            cursor = self.open_reader().cursor()
+            cursor.execute(query, params or ())
+            return cursor
+        
+        cursor = self.reader().cursor()
+        cursor.execute(query, params or ())
+        if fetch == 'one':
+            return cursor.fetchone()
+        elif fetch:
+            return cursor.fetchall()
+        return True
+    
+    def open_reader(self):
+        """Open a new read-only connection to the database"""
+        # check_same_thread=False only so on_closing can close it from the Tk thread
+        read_conn = sqlite3.connect('file:attendance.db?mode=ro', uri=True,
+                                    timeout=10.0, check_same_thread=False)
+        self.configure_connection(read_conn)
+        return read_conn
+    
+    def reader(self):
+        """Return the calling thread's read-only connection, opening it on first use"""
+        read_conn = getattr(self.reader_local, 'conn', None)
+        if read_conn is None:
+            read_conn = self.open_reader()
+            self.reader_local.conn = read_conn
+            with self.read_connections_lock:
+                self.read_connections.append(read_conn)
+        return read_conn
+    
+    def write_statement(self, query, params=None, fetch=False):
+        """Run one write on the writer connection; inside transaction() it commits with the block"""
+        cursor = self.conn.execute(query, params or ())
+        if fetch == 'one':
+            return cursor.fetchone()
+        elif fetch:
+            return cursor.fetchall()
+        return True
     
     def create_directories(self):
         """Create necessary directories for storing photos and encodings"""
         directories = ['photos', 'encodings', 'trained_models']
         for directory in directories:
-            if not os.path.exists(directory):
-                os.makedirs(directory)
+            os.makedirs(directory, exist_ok=True)
 
-    def ensure_column(self, table_name, column_name, column_definition):
-        """Add a column to a table if it doesn't already exist"""
+    def ensure_columns(self, table_name, column_definitions):
+        """Add any of the {column_name: column_definition} columns a table doesn't have yet"""
         try:
+            # One table_info read per table, however many columns are checked
             self.cursor.execute(f'PRAGMA table_info({table_name})')
-            columns = [info[1] for info in self.cursor.fetchall()]
-            if column_name not in columns:
-                self.cursor.execute(f'ALTER TABLE {table_name} ADD COLUMN {column_definition}')
-                self.conn.commit()
+            columns = {info[1] for info in self.cursor.fetchall()}
         except Exception as e:
-            print(f"Warning: Could not add column {column_name} to {table_name}: {e}")
+            print(f"Warning: Could not read columns of {table_name}: {e}")
+            return
+        for column_name, column_definition in column_definitions.items():
+            if column_name in columns:
+                continue
+            try:
+                self.cursor.execute(f'ALTER TABLE {table_name} ADD COLUMN {column_definition}')
+            except Exception as e:
+                print(f"Warning: Could not add column {column_name} to {table_name}: {e}")
 
-    @staticmethod
-    def is_valid_email(value):
+    @classmethod
+    def is_valid_email(cls, value):
         """Return True if value matches a basic email pattern"""
-        pattern = r'^[^@]+@[^@]+\.[^@]+$'
-        return re.match(pattern, value) is not None
+        return cls.EMAIL_PATTERN.match(value) is not None
 
     @staticmethod
     def generate_otp():
-        """Generate a simple 6-digit OTP code"""
-        return f"{random.randint(0, 999999):06d}"
+        """Generate a 6-digit OTP code from a cryptographically secure source"""
+        return f"{secrets.randbelow(1000000):06d}"
+
+    @classmethod
+    def hash_password(cls, password):
+        """Return a salted scrypt (or PBKDF2-SHA256) digest string for storing a password"""
+        salt = secrets.token_bytes(16)
+        if hasattr(hashlib, 'scrypt'):
+            digest = hashlib.scrypt(password.encode('utf-8'), salt=salt,
+                                    n=cls.SCRYPT_N, r=cls.SCRYPT_R, p=cls.SCRYPT_P)
+            return f"scrypt${cls.SCRYPT_N}${cls.SCRYPT_R}${cls.SCRYPT_P}${salt.hex()}${digest.hex()}"
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt,
+                                     cls.PASSWORD_HASH_ITERATIONS)
+        return f"pbkdf2_sha256${cls.PASSWORD_HASH_ITERATIONS}${salt.hex()}${digest.hex()}"
+
+    @staticmethod
+    def is_password_hash(stored):
+        """Return True if a stored password is a digest rather than legacy plaintext"""
+        return bool(stored) and stored.startswith(('scrypt$', 'pbkdf2_sha256$'))
+
+    @classmethod
+    def needs_rehash(cls, stored):
+        """Return True if a stored password isn't in the format hash_password writes"""
+        preferred = 'scrypt$' if hasattr(hashlib, 'scrypt') else 'pbkdf2_sha256$'
+        return not stored.startswith(preferred)
+
+    @classmethod
+    def verify_password(cls, password, stored):
+        """Check a password against a stored digest (or a legacy plaintext value)"""
+        if not stored:
+            return False
+        if not cls.is_password_hash(stored):
+            return hmac.compare_digest(stored.encode('utf-8'), password.encode('utf-8'))
+        try:
+            if stored.startswith('scrypt$'):
+                _, n, r, p, salt_hex, digest_hex = stored.split('$')
+                digest = hashlib.scrypt(password.encode('utf-8'), salt=bytes.fromhex(salt_hex),
+                                        n=int(n), r=int(r), p=int(p))
+            else:
+                _, iterations, salt_hex, digest_hex = stored.split('$')
+                digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'),
+                                             bytes.fromhex(salt_hex), int(iterations))
+        except (ValueError, AttributeError):
+            return False
+        return hmac.compare_digest(digest.hex(), digest_hex)
 
     def load_face_encodings(self):
         """Load face encodings once and cache them for faster reuse"""
-        encoding_file = os.path.join('trained_models', 'face_encodings.pkl')
-        if not os.path.exists(encoding_file):
+        encoding_file = os.path.join('trained_models', 'face_encodings.npy')
+        names_file = os.path.join('trained_models', 'face_names.json')
+        legacy_file = os.path.join('trained_models', 'face_encodings.pkl')
+        
+        if os.path.exists(encoding_file) and os.path.exists(names_file):
+            source_file = encoding_file
+        elif os.path.exists(legacy_file):
+            source_file = legacy_file
+        else:
             return None
         
-        file_mtime = os.path.getmtime(encoding_file)
-        if self.encoding_cache and self.encoding_cache.get('mtime') == file_mtime:
+        file_mtime = os.path.getmtime(source_file)
+        if (self.encoding_cache and self.encoding_cache.get('source') == source_file
+                and self.encoding_cache.get('mtime') == file_mtime):
             return self.encoding_cache.get('data')
         
-        with open(encoding_file, 'rb') as f:
-            encoding_data = pickle.load(f)
-            self.encoding_cache = {
-                'mtime': file_mtime,
-                'data': encoding_data
+        if source_file == encoding_file:
+            # One contiguous array read instead of unpickling a list of small arrays
+            with open(names_file, 'r', encoding='utf-8') as f:
+                names = json.load(f)
+            encoding_data = {
+                'encodings': np.load(encoding_file, allow_pickle=False),
+                'names': names
             }
-            return encoding_data
+        else:
+            # Models trained before the .npy format was introduced
+            with open(legacy_file, 'rb') as f:
+                encoding_data = pickle.load(f)
+        
+        # Stack the encodings once so recognition doesn't rebuild an array every frame
+        try:
+            matrix = np.ascontiguousarray(np.vstack(encoding_data['encodings']), dtype=np.float32)
+        except Exception:
+            matrix = None
+        
+        index = None
+        if faiss is not None and matrix is not None:
+            if len(matrix) >= self.FAISS_IVF_MIN_ROWS:
+                # Past this size an inverted-file index only scans the closest
+                # sqrt(N) clusters' worth of rows instead of all of them
+                nlist = int(np.sqrt(len(matrix)))
+                quantizer = faiss.IndexFlatL2(matrix.shape[1])
+                index = faiss.IndexIVFFlat(quantizer, matrix.shape[1], nlist)
+                index.train(matrix)
+                index.nprobe = self.FAISS_IVF_NPROBE
+            else:
+                index = faiss.IndexFlatL2(matrix.shape[1])
+            index.add(matrix)
+        
+        self.encoding_cache = {
+            'source': source_file,
+            'mtime': file_mtime,
+            'data': encoding_data,
+            'matrix': matrix,
+            # ||a - p||^2 = ||a||^2 - 2 a.p + ||p||^2, so keep ||a||^2 per row for a single GEMV
+            'row_norms_sq': np.einsum('ij,ij->i', matrix, matrix) if matrix is not None else None,
+            'scratch': np.empty(len(matrix), dtype=np.float32) if matrix is not None else None,
+            'index': index
+        }
+        return encoding_data
+
+    def match_face(self, face_encoding):
+        """Return (index, squared distance) of the closest cached known encoding"""
+        index = self.encoding_cache['index']
+        if index is not None:
+            distances, indices = index.search(face_encoding.astype(np.float32)[None], 1)
+            return int(indices[0, 0]), distances[0, 0]
+        
+        matrix = self.encoding_cache['matrix']
+        if nearest_encoding is not None:
+            # Single fused pass with no temporaries
+            best_match_index, best_distance_sq = nearest_encoding(matrix, face_encoding.astype(np.float32))
+            return int(best_match_index), best_distance_sq
+        
+        probe = face_encoding.astype(np.float32)
+        scores = self.encoding_cache['scratch']
+        np.dot(matrix, probe, out=scores)
+        scores *= -2.0
+        scores += self.encoding_cache['row_norms_sq']
+        # ||p||^2 is the same for every row, so it's only added to the winner
+        best_match_index = int(np.argmin(scores))
+        return best_match_index, max(float(scores[best_match_index] + probe.dot(probe)), 0.0)
 
     def warm_up_camera(self, cap, frames=5):
         """Read a few frames to let auto-exposure settle"""
@@ -242,7 +599,25 @@ class AttendanceSystem:
 
     def create_camera_instance(self):
         """Create and warm a new camera instance"""
-        backends = [cv2.CAP_DSHOW, cv2.CAP_MSMF, None]
+        if sys.platform.startswith('win'):
+            backends = [cv2.CAP_DSHOW, cv2.CAP_MSMF, None]
+        elif sys.platform.startswith('linux'):
+            backends = [cv2.CAP_V4L2, None]
+        else:
+            backends = [None]
+        
+        # Try the backend that worked last time first: a failing probe can take
+        # seconds to time out (DirectShow/MSMF on Windows)
+        backend_file = os.path.join('trained_models', 'camera_backend.json')
+        try:
+            with open(backend_file) as f:
+                last_backend = json.load(f)['backend']
+        except (OSError, ValueError, KeyError, TypeError):
+            last_backend = 'unknown'
+        if last_backend in backends:
+            backends.remove(last_backend)
+            backends.insert(0, last_backend)
+        
         for backend in backends:
             try:
                 cap = cv2.VideoCapture(0, backend) if backend is not None else cv2.VideoCapture(0)
@@ -250,8 +625,17 @@ class AttendanceSystem:
                 continue
 
             if cap.isOpened():
+                if backend != last_backend:
+                    try:
+                        with open(backend_file, 'w') as f:
+                            json.dump({'backend': backend}, f)
+                    except OSError:
+                        pass
                 cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
                 cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+                # Compressed MJPEG cuts USB bandwidth; a 1-frame buffer keeps frames fresh
+                cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+                cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
                 self.warm_up_camera(cap, frames=8)
                 return cap
 
@@ -279,59 +663,144 @@ class AttendanceSystem:
 
     def release_camera(self):
         """Release and reset the cached camera"""
+        self.stop_frame_grabber()
         with self.camera_lock:
             if self.camera and self.camera.isOpened():
                 self.camera.release()
             self.camera = None
             self.camera_ready.clear()
 
+    def start_frame_grabber(self, cap):
+        """Read frames from cap on a background thread; take_frame() returns the newest"""
+        self.stop_frame_grabber()
+        with self.camera_lock:
+            self.grabbed_frame = (True, None)
+        stop_event = threading.Event()
+        self.grabber_stop = stop_event
+        
+        def _target():
+            # cap.read() blocks on the USB transfer; doing it here keeps that off the Tk loop
+            while not stop_event.is_set():
+                ret, frame = cap.read()
+                with self.camera_lock:
+                    self.grabbed_frame = (ret, frame if ret else None)
+                if not ret:
+                    return
+        
+        self.grabber_thread = threading.Thread(target=_target, daemon=True)
+        self.grabber_thread.start()
+
+    def stop_frame_grabber(self):
+        """Stop the frame grabber thread, if one is running"""
+        self.grabber_stop.set()
+        if self.grabber_thread is not None:
+            self.grabber_thread.join(timeout=1.0)
+            self.grabber_thread = None
+
+    def take_frame(self):
+        """Return (ok, frame): frame is None until the grabber has a new one, ok False once reads fail"""
+        with self.camera_lock:
+            ret, frame = self.grabbed_frame
+            if frame is not None:
+                # Hand the frame over; the grabber stores a new array on every read
+                self.grabbed_frame = (True, None)
+        return ret, frame
+
+    def create_preview_window(self, title):
+        """Open a window with a label that camera frames are painted into"""
+        window = tk.Toplevel(self.root)
+        window.title(title)
+        window.configure(bg='black')
+        window.transient(self.root)
+        video_label = tk.Label(window, bg='black')
+        video_label.pack()
+        window.focus_force()
+        self.preview_window = window
+        return window, video_label
+
+    def close_preview_window(self):
+        """Destroy the camera preview window if it is open"""
+        if self.preview_window is not None:
+            try:
+                self.preview_window.destroy()
+            except tk.TclError:
+                pass
+            self.preview_window = None
+
+    def on_preview_destroyed(self, window, callback):
+        """Call callback once the preview window is destroyed, however that happens"""
+        # Logout's clear_window destroys the window without WM_DELETE_WINDOW and
+        # cancels its after() loop too, so the loop alone would never see it go
+        def destroyed(event):
+            # <Destroy> is also delivered for each child; only the window itself counts
+            if event.widget is not window:
+                return
+            if self.preview_window is window:
+                self.preview_window = None
+            callback()
+        window.bind('<Destroy>', destroyed, add='+')
+
+    @staticmethod
+    def show_frame(video_label, frame):
+        """Paint a BGR frame into a Tk label"""
+        height, width = frame.shape[:2]
+        # PIL swaps BGR to RGB while unpacking, so no converted copy of the frame is made
+        image = ImageTk.PhotoImage(Image.frombuffer('RGB', (width, height),
+                                                    np.ascontiguousarray(frame), 'raw', 'BGR', 0, 1))
+        video_label.configure(image=image)
+        # Tk doesn't keep a reference to the image, so hold one on the label
+        video_label.image = image
+
     def upsert_student_record(self, username, password, email):
         """Ensure the students table mirrors the login credentials"""
-        try:
-            existing = self.execute_db(
-                'SELECT id FROM students WHERE username = ?',
-                (username,),
-                fetch='one'
-            )
-            if existing:
-                self.execute_db(
-                    'UPDATE students SET password = ?, email = ? WHERE username = ?',
-                    (password, email, username)
-                )
-            else:
-                self.execute_db(
-                    'INSERT INTO students (username, password, email) VALUES (?, ?, ?)',
-                    (username, password, email)
-                )
-        except Exception as e:
-            raise e
+        # One statement; the UNIQUE username turns a repeat into an update
+        self.execute_db('''
+            INSERT INTO students (username, password, email) VALUES (?, ?, ?)
+            ON CONFLICT(username) DO UPDATE SET password = excluded.password, email = excluded.email
+        ''', (username, password, email))
 
-    def open_camera(self):
-        """Return a warmed camera instance, opening it if needed"""
+    def open_camera(self, callback):
+        """Call callback on the Tk thread with a warmed camera (None if it can't be opened)"""
         with self.camera_lock:
-            if self.camera and self.camera.isOpened():
-                return self.camera
-
-        cap = self.create_camera_instance()
-        if cap:
+            cap = self.camera if self.camera and self.camera.isOpened() else None
+        if cap is not None:
+            callback(cap)
+            return
+        if self.camera_waiting:
+            return  # A camera is already on its way to an earlier request
+        
+        # The camera is opened on the preload thread (started here if needed) and Tk
+        # polls it; a slow open never blocks the main loop. Reusing an in-flight
+        # preload also avoids a second instance, which can wedge the device on MSMF
+        self.preload_camera_async()
+        preload = self.camera_thread
+        user = self.current_user
+        self.camera_waiting = True
+        
+        def check():
+            if preload.is_alive():
+                self.root.after(20, check)
+                return
+            self.camera_waiting = False
+            if self.current_user != user:
+                return  # Logged out while the camera was opening
             with self.camera_lock:
-                self.camera = cap
-                self.camera_ready.set()
-            return self.camera
+                cap = self.camera if self.camera and self.camera.isOpened() else None
+            callback(cap)
         
-        return None
+        check()
     
     def show_login_screen(self):
         """Display login/register screen"""
         self.clear_window()
         
         # Title
-        title_label = tk.Label(self.root, text="Facial Recognition Attendance System", 
+        title_label = tk.Label(self.screen, text="Facial Recognition Attendance System", 
                               font=('Arial', 20, 'bold'), bg='#f0f0f0')
         title_label.pack(pady=30)
         
         # Login Frame
-        login_frame = tk.Frame(self.root, bg='#f0f0f0')
+        login_frame = tk.Frame(self.screen, bg='#f0f0f0')
         login_frame.pack(pady=20)
         
         tk.Label(login_frame, text="Username:", font=('Arial', 12), bg='#f0f0f0').grid(row=0, column=0, padx=10, pady=10, sticky='e')
@@ -343,7 +812,7 @@ class AttendanceSystem:
         self.login_password.grid(row=1, column=1, padx=10, pady=10)
         
         # Buttons
-        button_frame = tk.Frame(self.root, bg='#f0f0f0')
+        button_frame = tk.Frame(self.screen, bg='#f0f0f0')
         button_frame.pack(pady=20)
         
         login_btn = tk.Button(button_frame, text="Login", font=('Arial', 12, 'bold'),
@@ -366,15 +835,18 @@ class AttendanceSystem:
             return
         
         try:
-            # Use direct cursor for SELECT to avoid commit issues
-            self.cursor.execute('SELECT password, is_admin FROM users WHERE username = ?', (username,))
-            result = self.cursor.fetchone()
+            result = self.execute_db('SELECT password, is_admin FROM users WHERE username = ?',
+                                     (username,), fetch='one')
             
             if result:
                 stored_password = result[0]
                 is_admin = result[1] == 1
                 
-                if stored_password == password:
+                if self.verify_password(password, stored_password):
+                    if self.needs_rehash(stored_password):
+                        # Migrate plaintext/older digests on their next successful login;
+                        # hashing and the write happen on the pool, login doesn't wait
+                        self.io_pool.submit(self.rehash_login_password, username, password)
                     self.current_user = username
                     self.is_admin = is_admin
                     self.show_main_screen()
@@ -505,11 +977,12 @@ class AttendanceSystem:
                 return
             
             try:
+                hashed = self.hash_password(password)
                 self.execute_db(
                     'INSERT INTO users (username, password, email, otp_verified) VALUES (?, ?, ?, 1)', 
-                    (username, password, email)
+                    (username, hashed, email)
                 )
-                self.upsert_student_record(username, password, email)
+                self.upsert_student_record(username, hashed, email)
                 status_label.config(text="Registration successful!", fg='green')
                 messagebox.showinfo("Success", "Registration successful! Please login.")
                 dialog.destroy()
@@ -553,12 +1026,12 @@ class AttendanceSystem:
         if self.is_admin:
             welcome_text += " (Admin)"
         
-        welcome_label = tk.Label(self.root, text=welcome_text, 
+        welcome_label = tk.Label(self.screen, text=welcome_text, 
                                 font=('Arial', 16, 'bold'), bg='#f0f0f0')
         welcome_label.pack(pady=20)
         
         # Buttons Frame
-        button_frame = tk.Frame(self.root, bg='#f0f0f0')
+        button_frame = tk.Frame(self.screen, bg='#f0f0f0')
         button_frame.pack(pady=20)
         
         # Attendance In Button
@@ -612,7 +1085,7 @@ class AttendanceSystem:
             admin_profile_btn.grid(row=3, column=0, columnspan=2, padx=10, pady=10)
         
         # Logout Button
-        logout_btn = tk.Button(self.root, text="Logout", font=('Arial', 10),
+        logout_btn = tk.Button(self.screen, text="Logout", font=('Arial', 10),
                                bg='#757575', fg='white', width=15,
                                command=self.logout)
         logout_btn.pack(pady=20)
@@ -622,6 +1095,10 @@ class AttendanceSystem:
     
     def add_photo(self):
         """Capture photos for a student"""
+        if self.preview_window is not None and self.preview_window.winfo_exists():
+            self.preview_window.lift()
+            return
+        
         username = simpledialog.askstring("Add Photo", "Enter student username:")
         if not username:
             return
@@ -653,16 +1130,17 @@ class AttendanceSystem:
         
         # Create directory for student photos
         student_photo_dir = os.path.join('photos', username)
-        if not os.path.exists(student_photo_dir):
-            os.makedirs(student_photo_dir)
+        os.makedirs(student_photo_dir, exist_ok=True)
         
         # Initialize camera (reuse warmed instance if available)
-        cap = self.open_camera()
-        if not cap or not cap.isOpened():
+        self.open_camera(lambda cap: self.start_photo_session(cap, username, student_photo_dir))
+    
+    def start_photo_session(self, cap, username, student_photo_dir):
+        """Run the photo capture preview for a student once the camera is open"""
+        if not cap:
             messagebox.showerror("Error", "Could not open camera")
             return
         
-        count = 0
         total_photos = 50
         
         messagebox.showinfo("Photo Capture", 
@@ -671,33 +1149,100 @@ class AttendanceSystem:
                            f"Press ESC to finish.\n"
                            f"Target: {total_photos} photos")
         
-        while count < total_photos:
-            ret, frame = cap.read()
+        window, video_label = self.create_preview_window(f"Capture Photos - {username}")
+        self.start_frame_grabber(cap)
+        session = {'active': True, 'count': 0, 'capture_requested': False, 'writes': [], 'notice': None,
+                   'face_boxes': [], 'boxes_until': 0.0}  # faces found by the last capture, and until when to show them
+        
+        def finish(show_summary=True):
+            if not session['active']:
+                return
+            session['active'] = False
+            self.stop_frame_grabber()
+            # Keep the camera open for the next session; it's released on logout/exit
+            self.close_preview_window()
+            if show_summary:
+                report_saved()
+        
+        def report_saved():
+            # The last few writes may still be running; poll them rather than block Tk
+            if not all(write.done() for write in session['writes']):
+                self.root.after(20, report_saved)
+                return
+            saved = sum(1 for write in session['writes'] if write.exception() is None and write.result())
+            if saved < session['count']:
+                messagebox.showwarning("Warning", f"Captured {session['count']} photos for {username}, "
+                                       f"but only {saved} could be saved")
+            else:
+                messagebox.showinfo("Success", f"Successfully captured {saved} photos for {username}")
+        
+        def request_capture(event=None):
+            session['capture_requested'] = True
+        
+        window.protocol("WM_DELETE_WINDOW", finish)
+        self.on_preview_destroyed(window, lambda: finish(show_summary=False))
+        window.bind('<space>', request_capture)  # Space to capture
+        window.bind('<Escape>', lambda event: finish())  # ESC to exit
+        
+        def update_frame():
+            if not session['active']:
+                return
+            if not window.winfo_exists():
+                finish(show_summary=False)
+                return
+            
+            ret, frame = self.take_frame()
             if not ret:
-                break
+                # Drop the shared camera so the next session reopens it
+                self.release_camera()
+                finish()
+                return
+            if frame is None:
+                window.after(5, update_frame)
+                return
+            
+            if session['capture_requested']:
+                session['capture_requested'] = False
+                # Only keep frames with a face in them; a half-size grayscale copy
+                # is plenty for HOG at enrollment distance
+                small_gray = cv2.cvtColor(cv2.resize(frame, (0, 0), fx=0.5, fy=0.5), cv2.COLOR_BGR2GRAY)
+                face_locations = face_recognition.face_locations(small_gray)
+                # Scaled back up to the preview, so the user sees what was found
+                session['face_boxes'] = [(left * 2, top * 2, right * 2, bottom * 2)
+                                         for top, right, bottom, left in face_locations]
+                session['boxes_until'] = time.monotonic() + 0.8
+                if not face_locations:
+                    session['notice'] = "No face found - photo not saved"
+                else:
+                    # Save the raw frame, before the on-screen overlay is drawn on it
+                    session['notice'] = None
+                    photo_path = os.path.join(student_photo_dir, f"{username}_{session['count']+1}.jpg")
+                    # Encode and write in the background; the copy keeps the overlay out of it
+                    session['writes'].append(self.io_pool.submit(
+                        cv2.imwrite, photo_path, frame.copy(), self.PHOTO_JPEG_PARAMS))
+                    session['count'] += 1
+                    print(f"Captured photo {session['count']}/{total_photos}")
+                    if session['count'] >= total_photos:
+                        finish()
+                        return
+            
+            if time.monotonic() < session['boxes_until']:
+                for left, top, right, bottom in session['face_boxes']:
+                    cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
             
             # Display count on frame
-            cv2.putText(frame, f"Photos captured: {count}/{total_photos}", 
+            cv2.putText(frame, f"Photos captured: {session['count']}/{total_photos}", 
                        (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
             cv2.putText(frame, "Press SPACE to capture, ESC to finish", 
                        (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+            if session['notice']:
+                cv2.putText(frame, session['notice'], 
+                           (10, 110), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
             
-            cv2.imshow('Capture Photos', frame)
-            
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord(' '):  # Space to capture
-                photo_path = os.path.join(student_photo_dir, f"{username}_{count+1}.jpg")
-                cv2.imwrite(photo_path, frame)
-                count += 1
-                print(f"Captured photo {count}/{total_photos}")
-            elif key == 27:  # ESC to exit
-                break
-        
-        self.release_camera()
-        self.preload_camera_async()
-        cv2.destroyAllWindows()
+            self.show_frame(video_label, frame)
+            window.after(1, update_frame)
         
-        messagebox.showinfo("Success", f"Successfully captured {count} photos for {username}")
+        update_frame()
     
     def register_new_student(self):
         """Register a new student (Admin only)"""
@@ -805,11 +1350,12 @@ class AttendanceSystem:
                 return
             
             try:
+                hashed = self.hash_password(password)
                 self.execute_db(
                     'INSERT INTO users (username, password, email, otp_verified, is_admin) VALUES (?, ?, ?, 1, 0)',
-                    (username, password, email)
+                    (username, hashed, email)
                 )
-                self.upsert_student_record(username, password, email)
+                self.upsert_student_record(username, hashed, email)
                 status_label.config(text="Student registered successfully!", fg='green')
                 messagebox.showinfo("Success", f"Student {username} registered successfully!")
                 dialog.destroy()
@@ -843,52 +1389,132 @@ class AttendanceSystem:
             messagebox.showerror("Error", "No photos directory found")
             return
         
-        student_dirs = [d for d in os.listdir(photos_dir) if os.path.isdir(os.path.join(photos_dir, d))]
+        # scandir entries carry their file type, so this is one directory read
+        # per folder with no stat per entry
+        with os.scandir(photos_dir) as entries:
+            student_dirs = [entry for entry in entries if entry.is_dir()]
         
         if not student_dirs:
             messagebox.showerror("Error", "No student photos found. Please add photos first.")
             return
         
-        total_photos = 0
+        photo_paths = []
+        photo_owners = []
         for student_dir in student_dirs:
-            student_path = os.path.join(photos_dir, student_dir)
-            photos = [f for f in os.listdir(student_path) if f.endswith('.jpg')]
+            with os.scandir(student_dir.path) as entries:
+                for photo in entries:
+                    if photo.name.endswith('.jpg') and photo.is_file():
+                        photo_paths.append(photo.path)
+                        photo_owners.append(student_dir.name)
+        
+        if dlib.DLIB_USE_CUDA:
+            # Stage 1: decode photos on a thread pool (cv2 releases the GIL while decoding)
+            with ThreadPoolExecutor(max_workers=min(8, (os.cpu_count() or 1) + 4)) as executor:
+                images = list(executor.map(self.read_training_image, photo_paths))
             
-            for photo in photos:
-                photo_path = os.path.join(student_path, photo)
-                try:
-                    # Load image
-                    image = face_recognition.load_image_file(photo_path)
-                    # Find face encodings
-                    encodings = face_recognition.face_encodings(image)
-                    
-                    if len(encodings) > 0:
-                        known_encodings.append(encodings[0])
-                        known_names.append(student_dir)
-                        total_photos += 1
-                except Exception as e:
-                    print(f"Error processing {photo_path}: {e}")
-                    continue
+            loaded_images = []
+            encoded_owners = []
+            for image, owner in zip(images, photo_owners):
+                if image is not None:
+                    loaded_images.append(image)
+                    encoded_owners.append(owner)
+            
+            # Stage 2: find and encode faces in GPU batches
+            encodings = self.encode_training_images(loaded_images)
+        else:
+            # CPU only: decode + encode each photo in its own process to use every core.
+            # Spawned, not forked: this process always has live threads (DB writer,
+            # io_pool, camera) whose held locks a forked child would inherit
+            with ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn')) as executor:
+                encodings = list(executor.map(encode_training_photo, photo_paths, chunksize=4))
+            encoded_owners = photo_owners
+        
+        total_photos = 0
+        for encoding, owner in zip(encodings, encoded_owners):
+            if encoding is not None:
+                known_encodings.append(encoding)
+                known_names.append(owner)
+                total_photos += 1
         
         if len(known_encodings) == 0:
             messagebox.showerror("Error", "No faces found in photos. Please check your photos.")
             return
         
-        # Save encodings
-        encoding_data = {
-            'encodings': known_encodings,
-            'names': known_names
-        }
+        known_encodings, known_names = self.average_encodings_per_student(known_encodings, known_names)
         
-        encoding_file = os.path.join('trained_models', 'face_encodings.pkl')
-        with open(encoding_file, 'wb') as f:
-            pickle.dump(encoding_data, f)
+        # Save encodings as a float16 .npy (upcast on load) with the names alongside.
+        # Names go first: the .npy mtime is what tells load_face_encodings to reload.
+        with open(os.path.join('trained_models', 'face_names.json'), 'w', encoding='utf-8') as f:
+            json.dump(known_names, f)
+        np.save(os.path.join('trained_models', 'face_encodings.npy'),
+                np.vstack(known_encodings).astype(np.float16))
         
         messagebox.showinfo("Success", 
                            f"Training completed!\n"
                            f"Processed {total_photos} photos\n"
                            f"Trained {len(set(known_names))} students")
     
+    @staticmethod
+    def average_encodings_per_student(encodings, names):
+        """Collapse each student's encodings into their mean encoding"""
+        grouped = {}
+        for encoding, name in zip(encodings, names):
+            grouped.setdefault(name, []).append(encoding)
+        
+        # dlib embeddings aren't unit length and the match threshold is a Euclidean
+        # distance, so the mean is kept as-is rather than L2-normalised
+        mean_names = list(grouped)
+        mean_encodings = [np.vstack(grouped[name]).mean(axis=0) for name in mean_names]
+        return mean_encodings, mean_names
+
+    @staticmethod
+    def read_training_image(photo_path):
+        """Read a training photo as an RGB array, or None if it can't be decoded"""
+        try:
+            image = cv2.imread(photo_path)
+            if image is None:
+                raise ValueError("unreadable image")
+            return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        except Exception as e:
+            print(f"Error processing {photo_path}: {e}")
+            return None
+
+    @staticmethod
+    def encode_training_images(images, batch_size=32):
+        """Return the first face encoding of each image (None where no face is found)"""
+        encodings = [None] * len(images)
+        
+        if dlib.DLIB_USE_CUDA:
+            # The CNN detector batches only same-sized images, so group by shape
+            by_shape = {}
+            for index, image in enumerate(images):
+                by_shape.setdefault(image.shape, []).append(index)
+            
+            for indices in by_shape.values():
+                for start in range(0, len(indices), batch_size):
+                    batch = indices[start:start + batch_size]
+                    try:
+                        batch_locations = face_recognition.batch_face_locations(
+                            [images[i] for i in batch], batch_size=len(batch))
+                        for index, locations in zip(batch, batch_locations):
+                            if locations:
+                                encodings[index] = face_recognition.face_encodings(
+                                    images[index], known_face_locations=locations[:1], num_jitters=1)[0]
+                    except Exception as e:
+                        print(f"Error encoding batch of {len(batch)} training images: {e}")
+            return encodings
+        
+        for index, image in enumerate(images):
+            try:
+                locations = face_recognition.face_locations(image)
+                if locations:
+                    # Only the first face is kept, so skip encoding the rest
+                    encodings[index] = face_recognition.face_encodings(
+                        image, known_face_locations=locations[:1])[0]
+            except Exception as e:
+                print(f"Error encoding training image {index}: {e}")
+        return encodings
+    
     def mark_attendance_in(self):
         """Mark attendance in using face recognition"""
         self.mark_attendance('in')
@@ -899,6 +1525,10 @@ class AttendanceSystem:
     
     def mark_attendance(self, attendance_type):
         """Mark attendance using face recognition"""
+        if self.preview_window is not None and self.preview_window.winfo_exists():
+            self.preview_window.lift()
+            return
+        
         encoding_data = self.load_face_encodings()
         if encoding_data is None:
             messagebox.showerror("Error", "Model not trained. Please train the dataset first.")
@@ -910,193 +1540,460 @@ class AttendanceSystem:
             messagebox.showerror("Error", f"Trained model is invalid: {str(e)}")
             return
         
-        if len(known_encodings) == 0:
+        if len(known_encodings) == 0 or self.encoding_cache['matrix'] is None:
             messagebox.showerror("Error", "No trained faces found. Please train the dataset first.")
             return
         
-        # Close any existing OpenCV windows
-        cv2.destroyAllWindows()
+        # One query up front so repeat recognitions don't need to touch the database
+        try:
+            self.load_attendance_marks(datetime.now().date().isoformat())
+        except sqlite3.Error as e:
+            print(f"Warning: Could not preload today's attendance: {e}")
+            self.attendance_marks = None
         
         # Initialize camera using optimized helper
-        if not self.camera_ready.is_set():
-            self.preload_camera_async()
-        cap = self.open_camera()
-        if not cap or not cap.isOpened():
+        self.open_camera(lambda cap: self.start_attendance_session(cap, attendance_type, known_names))
+    
+    def start_attendance_session(self, cap, attendance_type, known_names):
+        """Run the face recognition preview for one IN/OUT mark once the camera is open"""
+        if not cap:
             messagebox.showerror("Error", "Could not open camera")
             return
         
-        # Use consistent window name
-        window_name = 'Face Recognition - Attendance ' + attendance_type.upper()
+        # Squared distance threshold (sqrt is skipped in match_face)
+        match_threshold_sq = 0.55 ** 2
+        
+        window, video_label = self.create_preview_window(
+            'Face Recognition - Attendance ' + attendance_type.upper())
+        self.start_frame_grabber(cap)
         
-        recognized = False
-        recognition_count = 0
         required_matches = 3  # Require 3 consecutive matches for reliability
-        last_recognized_name = None
-        frame_count = 0
-        process_every = 2  # process every other frame for speed
+        session = {
+            'active': True,
+            'recognition_count': 0,
+            'last_recognized_name': None,
+            'tracked_faces': [],  # (box, label, color) from the last inference result
+            'name_display': "Looking for face...",
+            'color': (255, 255, 255),
+            'inference_pending': False,
+            'marking': False,  # set once attendance is queued; recognition pauses
+            'toast': None,  # (text, color) drawn over the preview instead of a dialog
+            'small_frame': None  # quarter-size resize target, reused every frame
+        }
         
-        while not recognized:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            frame_count += 1
-            
-            # Flip frame horizontally for mirror effect
-            frame = cv2.flip(frame, 1)
+        # Run detection + encoding on a worker so the preview keeps the camera frame rate
+        frame_queue = queue.Queue(maxsize=1)
+        result_queue = queue.Queue()
+        stop_inference = threading.Event()
+        inference_thread = threading.Thread(
+            target=self.face_inference_worker,
+            args=(frame_queue, result_queue, stop_inference, self.face_detection_model),
+            daemon=True
+        )
+        inference_thread.start()
+        
+        def stop_session():
+            if not session['active']:
+                return
+            session['active'] = False
+            self.stop_frame_grabber()
+            stop_inference.set()
+            inference_thread.join(timeout=1.0)
+            # Keep the camera open for the next session; it's released on logout/exit
+            self.close_preview_window()
+        
+        def show_result(text, is_success):
+            if not session['active']:
+                # The preview was closed while the write was in flight
+                show = messagebox.showinfo if is_success else messagebox.showwarning
+                show("Success" if is_success else "Warning", text)
+                return
+            session['toast'] = (text, (0, 255, 0) if is_success else (0, 165, 255))
+            window.after(1500, stop_session)
+        
+        window.protocol("WM_DELETE_WINDOW", stop_session)
+        self.on_preview_destroyed(window, stop_session)
+        window.bind('<Escape>', lambda event: stop_session())
+        
+        def draw_status(frame):
+            text, color = session['toast'] or (session['name_display'], session['color'])
+            cv2.putText(frame, text, (10, 30), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+            cv2.putText(frame, "Press ESC to cancel", 
+                       (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+        
+        def update_frame():
+            if not session['active']:
+                return
+            if not window.winfo_exists():
+                stop_session()
+                return
             
-            if frame_count % process_every != 0:
-                cv2.putText(frame, "Optimizing... hold steady.", (10, 30), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-                cv2.imshow(window_name, frame)
-                if cv2.waitKey(1) & 0xFF == 27:
-                    break
-                continue
+            ret, frame = self.take_frame()
+            if not ret:
+                # Drop the shared camera so the next session reopens it
+                self.release_camera()
+                stop_session()
+                return
+            if frame is None:
+                window.after(5, update_frame)
+                return
             
-            # Convert BGR to RGB
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            # Flip frame horizontally for mirror effect (in place, no new full-size buffer)
+            cv2.flip(frame, 1, dst=frame)
             
-            # Resize frame for faster processing (optional)
-            small_frame = cv2.resize(rgb_frame, (0, 0), fx=0.25, fy=0.25)
-            small_rgb_frame = small_frame
+            if not session['inference_pending'] and not session['marking']:
+                # Shrink first (into a buffer reused across frames), then swap channels
+                # on the small frame only; the contiguous copy is the single ~60KB
+                # allocation per submitted frame. INTER_AREA averages the 4x4 blocks
+                # instead of skipping pixels, so small faces don't alias away
+                height, width = frame.shape[:2]
+                session['small_frame'] = cv2.resize(frame, (width // 4, height // 4),
+                                                    dst=session['small_frame'],
+                                                    interpolation=cv2.INTER_AREA)
+                frame_queue.put(np.ascontiguousarray(session['small_frame'][:, :, ::-1]))
+                session['inference_pending'] = True
             
-            # Find faces and encodings
-            face_locations = face_recognition.face_locations(small_rgb_frame, model='hog')
-            face_encodings = face_recognition.face_encodings(small_rgb_frame, face_locations)
+            try:
+                face_locations, face_encodings, fresh_encodings = result_queue.get_nowait()
+                session['inference_pending'] = False
+            except queue.Empty:
+                # Hold the last detected boxes until the worker has a new result
+                for (left, top, right, bottom), label, box_color in session['tracked_faces']:
+                    cv2.rectangle(frame, (left, top), (right, bottom), box_color, 2)
+                    cv2.putText(frame, label, (left, top - 10), 
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.9, box_color, 2)
+                draw_status(frame)
+                self.show_frame(video_label, frame)
+                window.after(1, update_frame)
+                return
             
             # Scale back up face locations since the frame we detected in was scaled to 1/4 size
             face_locations = [(top*4, right*4, bottom*4, left*4) for (top, right, bottom, left) in face_locations]
             
-            name_display = "Looking for face..."
-            color = (255, 255, 255)
+            session['name_display'] = "Looking for face..."
+            session['color'] = (255, 255, 255)
+            session['tracked_faces'] = []
             
             if len(face_locations) == 0:
-                name_display = "No face detected. Please look at the camera."
-                color = (0, 165, 255)  # Orange
-            else:
-                for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
-                    # Compare with known faces - use more lenient tolerance
-                    matches = face_recognition.compare_faces(known_encodings, face_encoding, tolerance=0.55)
-                    face_distances = face_recognition.face_distance(known_encodings, face_encoding)
+                session['name_display'] = "No face detected. Please look at the camera."
+                session['color'] = (0, 165, 255)  # Orange
+            
+            for (top, right, bottom, left), face_encoding, is_fresh in zip(
+                    face_locations, face_encodings, fresh_encodings):
+                # Compare with known faces in one vectorized pass
+                best_match_index, best_distance_sq = self.match_face(face_encoding)
+                
+                # Check if match is good enough (distance <= 0.55)
+                if best_distance_sq <= match_threshold_sq:
+                    current_name = known_names[best_match_index]
+                    
+                    # Require consecutive matches for reliability; a reused encoding
+                    # repeats an earlier match, so only fresh encodings count
+                    if current_name == session['last_recognized_name']:
+                        if is_fresh:
+                            session['recognition_count'] += 1
+                    else:
+                        session['recognition_count'] = 1 if is_fresh else 0
+                        session['last_recognized_name'] = current_name
+                    recognition_count = session['recognition_count']
                     
-                    if len(face_distances) > 0:
-                        best_match_index = np.argmin(face_distances)
-                        best_distance = face_distances[best_match_index]
-                        
-                        # Check if match is good enough (distance < 0.6)
-                        if matches[best_match_index] and best_distance < 0.6:
-                            current_name = known_names[best_match_index]
-                            
-                            # Require consecutive matches for reliability
-                            if current_name == last_recognized_name:
-                                recognition_count += 1
-                            else:
-                                recognition_count = 1
-                                last_recognized_name = current_name
-                            
-                            # Draw rectangle and name
-                            cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-                            cv2.putText(frame, current_name, (left, top - 10), 
-                                       cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-                            cv2.putText(frame, f"Match: {recognition_count}/{required_matches}", 
-                                       (left, bottom + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-                            
-                            name_display = f"Recognized: {current_name} ({recognition_count}/{required_matches})"
-                            color = (0, 255, 0)
-                            
-                            # If we have enough consecutive matches, mark attendance
-                            if recognition_count >= required_matches:
-                                name = current_name
-                                recognized = True
-                                
-                                # Show recognition on screen for a moment
-                                cv2.putText(frame, f"ATTENDANCE MARKED: {name}", 
-                                           (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 3)
-                                cv2.imshow(window_name, frame)
-                                cv2.waitKey(1000)  # Show for 1 second
-                                
-                                # Save attendance - convert date/time to strings for SQLite
-                                today = datetime.now().date().isoformat()  # Convert to string
-                                current_time = datetime.now().time().strftime('%H:%M:%S')  # Convert to string
-                                
-                                if attendance_type == 'in':
-                                    # Check if already marked in today
-                                    try:
-                                        result = self.execute_db('''
-                                            SELECT id FROM attendance 
-                                            WHERE student_username = ? AND date = ? AND time_in IS NOT NULL
-                                        ''', (name, today), fetch='one')
-                                        if result:
-                                            messagebox.showwarning("Warning", 
-                                                                  f"{name} has already marked attendance IN today")
-                                        else:
-                                            self.execute_db('''
-                                                INSERT INTO attendance (student_username, date, time_in, status)
-                                                VALUES (?, ?, ?, ?)
-                                            ''', (name, today, current_time, 'Present'))
-                                            messagebox.showinfo("Success", 
-                                                               f"Attendance IN marked for {name}\n"
-                                                               f"Time: {current_time}")
-                                    except sqlite3.OperationalError as e:
-                                        if "database is locked" in str(e).lower():
-                                            messagebox.showerror("Error", "Database is busy. Please try again.")
-                                        else:
-                                            messagebox.showerror("Error", f"Failed to mark attendance: {str(e)}")
-                                    except Exception as e:
-                                        messagebox.showerror("Error", f"Failed to mark attendance: {str(e)}")
-                                else:  # out
-                                    # Check if marked in today
-                                    try:
-                                        result = self.execute_db('''
-                                            SELECT id FROM attendance 
-                                            WHERE student_username = ? AND date = ? AND time_in IS NOT NULL
-                                        ''', (name, today), fetch='one')
-                                        if not result:
-                                            messagebox.showwarning("Warning", 
-                                                                  f"{name} has not marked attendance IN today")
-                                        else:
-                                            # Update time_out
-                                            self.execute_db('''
-                                                UPDATE attendance 
-                                                SET time_out = ?, status = 'Completed'
-                                                WHERE student_username = ? AND date = ? AND time_out IS NULL
-                                            ''', (current_time, name, today))
-                                            messagebox.showinfo("Success", 
-                                                               f"Attendance OUT marked for {name}\n"
-                                                               f"Time: {current_time}")
-                                    except sqlite3.OperationalError as e:
-                                        if "database is locked" in str(e).lower():
-                                            messagebox.showerror("Error", "Database is busy. Please try again.")
-                                        else:
-                                            messagebox.showerror("Error", f"Failed to mark attendance: {str(e)}")
-                                    except Exception as e:
-                                        messagebox.showerror("Error", f"Failed to mark attendance: {str(e)}")
-                                
-                                break
-                        else:
-                            # Face detected but not recognized
-                            cv2.rectangle(frame, (left, top), (right, bottom), (0, 165, 255), 2)
-                            cv2.putText(frame, "Unknown", (left, top - 10), 
-                                       cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 165, 255), 2)
-                            name_display = "Face detected but not recognized"
-                            color = (0, 165, 255)
-                            recognition_count = 0
-                            last_recognized_name = None
+                    # Draw rectangle and name
+                    cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+                    cv2.putText(frame, current_name, (left, top - 10), 
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+                    session['tracked_faces'].append(((left, top, right, bottom), current_name, (0, 255, 0)))
+                    cv2.putText(frame, f"Match: {recognition_count}/{required_matches}", 
+                               (left, bottom + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+                    
+                    session['name_display'] = f"Recognized: {current_name} ({recognition_count}/{required_matches})"
+                    session['color'] = (0, 255, 0)
+                    
+                    # If we have enough consecutive matches, mark attendance
+                    if recognition_count >= required_matches:
+                        # Queue the write and keep the preview running; the outcome
+                        # replaces the status line once the writer thread reports back
+                        session['marking'] = True
+                        session['toast'] = (f"Saving attendance for {current_name}...", (0, 255, 0))
+                        self.save_attendance(current_name, attendance_type, show_result)
+                        break
+                else:
+                    # Face detected but not recognized
+                    cv2.rectangle(frame, (left, top), (right, bottom), (0, 165, 255), 2)
+                    cv2.putText(frame, "Unknown", (left, top - 10), 
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 165, 255), 2)
+                    session['tracked_faces'].append(((left, top, right, bottom), "Unknown", (0, 165, 255)))
+                    session['name_display'] = "Face detected but not recognized"
+                    session['color'] = (0, 165, 255)
+                    session['recognition_count'] = 0
+                    session['last_recognized_name'] = None
             
-            # Display status text
-            cv2.putText(frame, name_display, (10, 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-            cv2.putText(frame, f"Press ESC to cancel", 
-                       (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+            draw_status(frame)
+            self.show_frame(video_label, frame)
+            window.after(1, update_frame)
+        
+        update_frame()
+
+    def save_attendance(self, name, attendance_type, notify):
+        """Record a recognized student's IN/OUT and pass notify(text, is_success) the outcome"""
+        # Save attendance - convert date/time to strings for SQLite
+        today = datetime.now().date().isoformat()  # Convert to string
+        current_time = datetime.now().time().strftime('%H:%M:%S')  # Convert to string
+        
+        future = self.record_attendance(name, attendance_type, today, current_time)
+        
+        def report(future):
+            try:
+                outcome = future.result()
+            except sqlite3.OperationalError as e:
+                if "database is locked" in str(e).lower():
+                    messagebox.showerror("Error", "Database is busy. Please try again.")
+                else:
+                    messagebox.showerror("Error", f"Failed to mark attendance: {str(e)}")
+                notify("Attendance not saved", False)
+                return
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to mark attendance: {str(e)}")
+                notify("Attendance not saved", False)
+                return
+            
+            self.remember_attendance_mark(name, attendance_type, today, outcome)
+            if outcome == 'marked':
+                notify(f"Attendance {attendance_type.upper()} marked for {name} at {current_time}", True)
+            elif outcome == 'already_in':
+                notify(f"{name} has already marked attendance IN today", False)
+            elif outcome == 'already_out':
+                notify(f"{name} has already marked attendance OUT today", False)
+            else:  # not_in
+                notify(f"{name} has not marked attendance IN today", False)
+        
+        # The write lands on the writer thread; report back without blocking the UI
+        self.when_done(future, report)
+
+    def when_done(self, future, callback):
+        """Call callback(future) from the Tk loop once future has finished"""
+        def check():
+            if not future.done():
+                self.root.after(20, check)
+                return
+            callback(future)
+        check()
+
+    def load_attendance_marks(self, today):
+        """Cache which students have already marked IN/OUT on the given day"""
+        rows = self.execute_db('''
+            SELECT student_username, time_in, time_out FROM attendance WHERE date = ?
+        ''', (today,), fetch=True)
+        self.attendance_marks = {
+            'date': today,
+            'in': {username for username, time_in, _ in rows if time_in is not None},
+            'out': {username for username, _, time_out in rows if time_out is not None}
+        }
+
+    def remember_attendance_mark(self, name, attendance_type, today, outcome):
+        """Add a confirmed IN/OUT to today's marks cache"""
+        marks = self.attendance_marks
+        if marks is None or marks['date'] != today:
+            return
+        if outcome in ('marked', 'already_in' if attendance_type == 'in' else 'already_out'):
+            marks[attendance_type].add(name)
+
+    def record_attendance(self, name, attendance_type, today, current_time):
+        """Queue an IN/OUT write; return a Future for 'marked', 'already_in', 'not_in' or 'already_out'"""
+        future = Future()
+        marks = self.attendance_marks
+        if marks is not None and marks['date'] != today:
+            marks = None
+        
+        # Known marks short-circuit; misses still go to the database, which stays authoritative
+        if marks is not None:
+            if attendance_type == 'in' and name in marks['in']:
+                future.set_result('already_in')
+                return future
+            if attendance_type == 'out' and name in marks['out']:
+                future.set_result('already_out')
+                return future
+        
+        self.write_queue.put(('attendance', (name, attendance_type, today, current_time), future))
+        return future
+
+    def write_attendance(self, name, attendance_type, today, current_time):
+        """Apply one IN/OUT write; the caller holds an open transaction()"""
+        statements = self.ATTENDANCE_STATEMENTS
+        if attendance_type == 'in':
+            cursor = self.conn.execute(statements['insert_time_in'],
+                                       (name, today, current_time, name, today))
+            return 'marked' if cursor.rowcount else 'already_in'
+        
+        cursor = self.conn.execute(statements['update_time_out'], (current_time, name, today))
+        if cursor.rowcount:
+            return 'marked'
+        
+        # Only the failure path pays for a second query, to pick the right message
+        marked_in = self.conn.execute(statements['find_time_in'], (name, today)).fetchone()
+        return 'already_out' if marked_in else 'not_in'
+
+    def apply_write(self, kind, args):
+        """Apply one queued write; the caller holds an open transaction()"""
+        if kind == 'attendance':
+            return self.write_attendance(*args)
+        elif kind == 'student_password':
+            return self.write_student_password(*args)
+        elif kind == 'login_password':
+            return self.write_login_password(*args)
+        return self.write_statement(*args)
+
+    def queue_write(self, kind, args):
+        """Apply a write on the writer thread and wait for its result (not for the Tk thread)"""
+        writer = self.writer_thread
+        if writer is None or not writer.is_alive():
+            # No writer left to read the queue; write directly, as execute_db does
+            with self.transaction():
+                return self.apply_write(kind, args)
+        future = Future()
+        self.write_queue.put((kind, args, future))
+        return future.result()
+
+    def apply_write_batch(self, batch):
+        """Run queued writes in one transaction; a failing write only rolls back itself"""
+        results = []
+        with self.transaction() as conn:
+            for kind, args, _ in batch:
+                conn.execute('SAVEPOINT queued_write')
+                try:
+                    value = self.apply_write(kind, args)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO queued_write')
+                    results.append((False, e))
+                else:
+                    results.append((True, value))
+                conn.execute('RELEASE queued_write')
+        return results
+
+    def db_writer_loop(self, max_batch=64):
+        """Commit queued writes in batches until a None sentinel arrives"""
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                return
             
-            cv2.imshow(window_name, frame)
+            # Whatever piled up while the last batch committed goes into one transaction
+            batch = [item]
+            stopping = False
+            while len(batch) < max_batch:
+                try:
+                    item = self.write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
             
-            if cv2.waitKey(1) & 0xFF == 27:  # ESC
+            # Only another process can hold the write lock now; BEGIN IMMEDIATE
+            # reports that up front, before anything in the batch has run
+            error = None
+            for attempt in range(self.DB_RETRIES):
+                try:
+                    results = self.apply_write_batch(batch)
+                except sqlite3.OperationalError as e:
+                    if self.is_busy_error(e) and attempt < self.DB_RETRIES - 1:
+                        self.busy_backoff(attempt)
+                        continue
+                    error = e
+                except Exception as e:
+                    error = e
                 break
-        
-        self.release_camera()
-        cv2.destroyAllWindows()
-        self.preload_camera_async()
+            
+            if error is not None:
+                results = [(False, error)] * len(batch)
+            for (_, _, future), (succeeded, value) in zip(batch, results):
+                if succeeded:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            
+            if stopping:
+                return
+
+    @staticmethod
+    def is_usable_face(gray_frame, location, min_size=40, min_sharpness=50.0):
+        """Return True if a detected face box is big and sharp enough to encode"""
+        top, right, bottom, left = location
+        if (right - left) * (bottom - top) < min_size * min_size:
+            return False
+        
+        gray_crop = gray_frame[max(top, 0):bottom, max(left, 0):right]
+        if gray_crop.size == 0:
+            return False
+        # Variance of the Laplacian is a cheap focus measure: low means blurry
+        return cv2.Laplacian(gray_crop, cv2.CV_64F).var() >= min_sharpness
+
+    @staticmethod
+    def face_hash(gray_frame, location):
+        """Return a 64-bit difference hash of a face crop, stable while the face holds still"""
+        top, right, bottom, left = location
+        gray_crop = gray_frame[max(top, 0):bottom, max(left, 0):right]
+        tiny = cv2.resize(gray_crop, (9, 8), interpolation=cv2.INTER_AREA)
+        bits = np.packbits(tiny[:, 1:] > tiny[:, :-1])
+        return int.from_bytes(bits.tobytes(), 'big')
+
+    @staticmethod
+    def face_inference_worker(frame_queue, result_queue, stop_event, detection_model='hog',
+                              max_shift=2, max_hash_distance=4):
+        """Detect and encode faces for frames from frame_queue until stop_event is set"""
+        # Each result is (locations, encodings, fresh): fresh[i] is False when the
+        # encoding was reused from an earlier frame, so it is no new evidence
+        # (location, hash, encoding) for faces encoded on earlier frames; the hash
+        # is the one taken when the encoding was computed, so reuse can't drift
+        known_faces = []
+        while not stop_event.is_set():
+            try:
+                small_rgb_frame = frame_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            
+            try:
+                # One grayscale conversion serves the HOG detector (which only looks at
+                # gradients) and the blur/hash checks; CNN detection needs the color frame
+                gray_frame = cv2.cvtColor(small_rgb_frame, cv2.COLOR_RGB2GRAY)
+                detection_frame = gray_frame if detection_model == 'hog' else small_rgb_frame
+                face_locations = face_recognition.face_locations(detection_frame, model=detection_model)
+                # Don't spend an encoder pass on faces too small or blurry to match reliably
+                face_locations = [location for location in face_locations
+                                  if AttendanceSystem.is_usable_face(gray_frame, location)]
+                
+                # A face that sits in the same box and looks the same as last time
+                # reuses its encoding instead of another encoder pass
+                face_hashes = [AttendanceSystem.face_hash(gray_frame, location)
+                               for location in face_locations]
+                current_faces = []
+                to_encode = []
+                fresh = [False] * len(face_locations)
+                for location, face_hash in zip(face_locations, face_hashes):
+                    for known_location, known_hash, known_encoding in known_faces:
+                        if (max(abs(a - b) for a, b in zip(location, known_location)) <= max_shift
+                                and bin(face_hash ^ known_hash).count('1') <= max_hash_distance):
+                            current_faces.append((location, known_hash, known_encoding))
+                            break
+                    else:
+                        to_encode.append(len(current_faces))
+                        current_faces.append((location, face_hash, None))
+                
+                if to_encode:
+                    fresh_encodings = face_recognition.face_encodings(
+                        small_rgb_frame, [face_locations[i] for i in to_encode])
+                    for i, encoding in zip(to_encode, fresh_encodings):
+                        current_faces[i] = (face_locations[i], face_hashes[i], encoding)
+                        fresh[i] = True
+                known_faces = current_faces
+                face_encodings = [encoding for _, _, encoding in current_faces]
+            except Exception as e:
+                print(f"Face inference failed: {e}")
+                face_locations, face_encodings, fresh = [], [], []
+                known_faces = []
+            # Always answer so the capture loop never waits on a lost frame
+            result_queue.put((face_locations, face_encodings, fresh))
     
     def show_attendance_report(self):
         """Display attendance report"""
@@ -1125,25 +2022,23 @@ class AttendanceSystem:
         tree.configure(yscrollcommand=scrollbar.set)
         
         # Fetch attendance data
+        records = None
         try:
             records = self.execute_db('''
                 SELECT student_username, date, time_in, time_out, status
                 FROM attendance
                 ORDER BY date DESC, student_username
-            ''', fetch=True)
-            
-            for record in records:
-                tree.insert('', 'end', values=record)
+            ''', fetch='cursor')
+            # The first page goes in now; the rest streams in between Tk events
+            first_batch = records.fetchmany(self.REPORT_BATCH_SIZE)
             
-            # Get summary statistics
-            total_result = self.execute_db('SELECT COUNT(DISTINCT student_username) FROM attendance', 
-                                         fetch='one')
-            total_students = total_result[0] if total_result else 0
-            
-            today_result = self.execute_db('SELECT COUNT(*) FROM attendance WHERE date = ?', 
-                                         (datetime.now().date().isoformat(),), fetch='one')
-            today_attendance = today_result[0] if today_result else 0
+            # Get summary statistics in one pass; date = ? is 1 or 0 per row
+            total_students, today_attendance = self.execute_db(
+                'SELECT COUNT(DISTINCT student_username), COALESCE(SUM(date = ?), 0) FROM attendance',
+                (datetime.now().date().isoformat(),), fetch='one')
         except sqlite3.OperationalError as e:
+            if records is not None:
+                records.connection.close()
             if "database is locked" in str(e).lower():
                 messagebox.showerror("Error", "Database is busy. Please try again in a moment.")
                 report_window.destroy()
@@ -1153,6 +2048,30 @@ class AttendanceSystem:
                 report_window.destroy()
                 return
         
+        def report_destroyed(event):
+            # Destroying the window also cancels the pending insert_batch, so the
+            # stream is closed here; <Destroy> also arrives for each child widget
+            if event.widget is report_window:
+                records.connection.close()
+        
+        report_window.bind('<Destroy>', report_destroyed, add='+')
+        
+        def insert_batch(batch):
+            for record in batch:
+                tree.insert('', 'end', values=record)
+            if len(batch) < self.REPORT_BATCH_SIZE:
+                records.connection.close()
+                return
+            try:
+                next_batch = records.fetchmany(self.REPORT_BATCH_SIZE)
+            except sqlite3.Error as e:
+                records.connection.close()
+                messagebox.showerror("Error", f"Failed to load report: {str(e)}")
+                return
+            report_window.after(1, insert_batch, next_batch)
+        
+        insert_batch(first_batch)
+        
         tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
@@ -1165,12 +2084,52 @@ class AttendanceSystem:
                                 font=('Arial', 12, 'bold'))
         summary_label.pack()
     
+    def set_student_password(self, username, password):
+        """Hash and store a student's new password; return False if there is no such student"""
+        # The slow hash runs here on the pool; only the UPDATEs go to the writer thread
+        hashed = self.hash_password(password)
+        return self.queue_write('student_password', (username, hashed))
+
+    def write_student_password(self, username, hashed):
+        """Store a student's password digest; the caller holds an open transaction()"""
+        # Update students and users together. The students UPDATE doubles as the
+        # existence check; a users row might not exist, which simply updates nothing
+        cursor = self.conn.execute('UPDATE students SET password = ? WHERE username = ?', 
+                                   (hashed, username))
+        if cursor.rowcount == 0:
+            return False
+        self.conn.execute('UPDATE users SET password = ? WHERE username = ?', 
+                          (hashed, username))
+        return True
+
+    def rehash_login_password(self, username, password):
+        """Replace a plaintext/older stored password with a current digest (runs on io_pool)"""
+        try:
+            self.queue_write('login_password', (username, self.hash_password(password)))
+        except sqlite3.Error as e:
+            # The old digest still verifies; the upgrade is retried on the next login
+            print(f"Warning: Could not upgrade password hash for {username}: {e}")
+
+    def write_login_password(self, username, hashed):
+        """Store a login's digest in users and its students mirror; the caller holds an open transaction()"""
+        # Both rows change in the same savepoint; users without a student row update nothing there
+        self.conn.execute('UPDATE users SET password = ? WHERE username = ?', (hashed, username))
+        self.conn.execute('UPDATE students SET password = ? WHERE username = ?', (hashed, username))
+
     def show_admin_profile(self):
         """Display admin profile window with password management"""
         if not self.is_admin:
             messagebox.showerror("Error", "Access denied. Admin privileges required.")
             return
         
+        profile = self.admin_profile
+        if profile and profile['window'].winfo_exists():
+            # Already built this session; show it again with a fresh student list
+            profile['window'].deiconify()
+            profile['window'].lift()
+            profile['refresh']()
+            return
+        
         profile_window = tk.Toplevel(self.root)
         profile_window.title("Admin Profile")
         profile_window.geometry("900x700")
@@ -1221,7 +2180,7 @@ class AttendanceSystem:
             try:
                 result = self.execute_db('SELECT password FROM users WHERE username = ?', 
                                         (self.current_user,), fetch='one')
-                if not result or result[0] != current:
+                if not result or not self.verify_password(current, result[0]):
                     messagebox.showerror("Error", "Current password is incorrect")
                     return
                 
@@ -1235,7 +2194,7 @@ class AttendanceSystem:
                 
                 # Update password
                 self.execute_db('UPDATE users SET password = ? WHERE username = ?', 
-                              (new, self.current_user))
+                              (self.hash_password(new), self.current_user))
                 messagebox.showinfo("Success", "Password changed successfully!")
                 current_pass_entry.delete(0, tk.END)
                 new_pass_entry.delete(0, tk.END)
@@ -1265,23 +2224,52 @@ class AttendanceSystem:
         students_scrollbar = ttk.Scrollbar(view_students_frame, orient=tk.VERTICAL, command=students_tree.yview)
         students_tree.configure(yscrollcommand=students_scrollbar.set)
         
+        # generation is bumped on refresh so a stale stream stops; records is the latest stream
+        students_load = {'generation': 0, 'records': None}
+        
+        def students_tree_destroyed(event):
+            # Destroying the tree cancels the pending insert_students, which would
+            # otherwise have closed the stream
+            if students_load['records'] is not None:
+                students_load['records'].connection.close()
+        
+        students_tree.bind('<Destroy>', students_tree_destroyed, add='+')
+        
+        def insert_students(records, generation):
+            if generation != students_load['generation']:
+                records.connection.close()
+                return
+            try:
+                batch = records.fetchmany(self.REPORT_BATCH_SIZE)
+            except sqlite3.Error as e:
+                records.connection.close()
+                messagebox.showerror("Error", f"Failed to load students: {str(e)}")
+                return
+            insert = students_tree.insert
+            is_hash = self.is_password_hash
+            for username, password in batch:
+                # Digests are not shown; only legacy plaintext rows remain readable
+                insert('', 'end', values=(username, '(hashed)' if is_hash(password) else password))
+            if len(batch) < self.REPORT_BATCH_SIZE:
+                records.connection.close()
+                return
+            # Let the tab paint before the next page goes in
+            students_tree.after(1, insert_students, records, generation)
+        
         def load_students():
-            # Clear existing items
-            for item in students_tree.get_children():
-                students_tree.delete(item)
+            # Clear existing items in one Tcl call
+            students_tree.delete(*students_tree.get_children())
+            students_load['generation'] += 1
             
             try:
                 # Get all students from students table
                 records = self.execute_db('SELECT username, password FROM students ORDER BY username', 
-                                        fetch=True)
-                for record in records:
-                    # Be defensive: ensure each row is a proper 2‑item tuple for Treeview
-                    if not isinstance(record, (list, tuple)) or len(record) < 2:
-                        continue
-                    username, password = record[0], record[1]
-                    students_tree.insert('', 'end', values=(username, password))
+                                        fetch='cursor')
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to load students: {str(e)}")
+                return
+            students_load['records'] = records
+            insert_students(records, students_load['generation'])
         
         load_students()
         
@@ -1315,62 +2303,74 @@ class AttendanceSystem:
         student_confirm_pass_entry.grid(row=2, column=1, padx=10, pady=10)
         
         def change_student_password():
-            username = student_username_entry.get().strip()
-            new = student_new_pass_entry.get().strip()
-            confirm = student_confirm_pass_entry.get().strip()
-            
-            if not username or not new or not confirm:
-                messagebox.showerror("Error", "Please fill all fields")
-                return
+            entries = (student_username_entry, student_new_pass_entry, student_confirm_pass_entry)
+            username, new, confirm = (entry.get().strip() for entry in entries)
             
-            # Check if student exists
-            try:
-                result = self.execute_db('SELECT COUNT(*) FROM students WHERE username = ?', 
-                                        (username,), fetch='one')
-                if not result or result[0] == 0:
-                    messagebox.showerror("Error", f"Student '{username}' does not exist")
-                    return
-                
-                if new != confirm:
-                    messagebox.showerror("Error", "New password and confirm password do not match")
-                    return
-                
-                if len(new) < 3:
-                    messagebox.showerror("Error", "Password must be at least 3 characters")
+            checks = ((not all((username, new, confirm)), "Please fill all fields"),
+                      (new != confirm, "New password and confirm password do not match"),
+                      (len(new) < 3, "Password must be at least 3 characters"))
+            for failed, message in checks:
+                if failed:
+                    messagebox.showerror("Error", message)
                     return
-                
-                # Update password in students table
-                self.execute_db('UPDATE students SET password = ? WHERE username = ?', 
-                              (new, username))
-                
-                # Also update in users table if exists
+            
+            # Hashing and both UPDATEs run on the pool; the form stays responsive meanwhile
+            change_student_button.config(state=tk.DISABLED)
+            future = self.io_pool.submit(self.set_student_password, username, new)
+            
+            def finished(future):
+                if not change_student_button.winfo_exists():
+                    return  # The admin left this screen; nothing to update
+                change_student_button.config(state=tk.NORMAL)
                 try:
-                    self.execute_db('UPDATE users SET password = ? WHERE username = ?', 
-                                  (new, username))
-                except:
-                    pass  # User might not exist in users table, that's okay
-                
+                    if not future.result():
+                        messagebox.showerror("Error", f"Student '{username}' does not exist")
+                        return
+                except Exception as e:
+                    messagebox.showerror("Error", f"Failed to change password: {str(e)}")
+                    return
                 messagebox.showinfo("Success", f"Password changed successfully for {username}!")
-                student_username_entry.delete(0, tk.END)
-                student_new_pass_entry.delete(0, tk.END)
-                student_confirm_pass_entry.delete(0, tk.END)
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to change password: {str(e)}")
+                for entry in entries:
+                    entry.delete(0, tk.END)
+            
+            self.when_done(future, finished)
+        
+        change_student_button = tk.Button(student_pass_frame, text="Change Student Password", font=('Arial', 12, 'bold'),
+                                          bg='#F44336', fg='white', width=25, command=change_student_password)
+        change_student_button.grid(row=3, column=0, columnspan=2, pady=20)
+        
+        def hide_profile():
+            # The widgets are kept for next time, but not the passwords typed into them
+            for entry in (current_pass_entry, new_pass_entry, confirm_pass_entry,
+                          student_username_entry, student_new_pass_entry, student_confirm_pass_entry):
+                entry.delete(0, tk.END)
+            profile_window.withdraw()
         
-        tk.Button(student_pass_frame, text="Change Student Password", font=('Arial', 12, 'bold'),
-                 bg='#F44336', fg='white', width=25, command=change_student_password).grid(row=3, column=0, columnspan=2, pady=20)
+        profile_window.protocol("WM_DELETE_WINDOW", hide_profile)
+        self.admin_profile = {'window': profile_window, 'refresh': load_students}
     
     def logout(self):
         """Logout and return to login screen"""
         self.current_user = None
         self.is_admin = False
+        self.admin_profile = None
         self.release_camera()
         self.show_login_screen()
     
     def clear_window(self):
         """Clear all widgets from window"""
+        # One screen frame plus any open dialogs, rather than every widget of the screen
         for widget in self.root.winfo_children():
             widget.destroy()
+        self.screen = tk.Frame(self.root, bg='#f0f0f0')
+        self.screen.pack(fill=tk.BOTH, expand=True)
+
+def encode_training_photo(photo_path):
+    """Read one training photo and return its first face encoding (None if no face)"""
+    image = AttendanceSystem.read_training_image(photo_path)
+    if image is None:
+        return None
+    return AttendanceSystem.encode_training_images([image])[0]
 
 def main():
     root = tk.Tk()